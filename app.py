@@ -1,18 +1,89 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import asyncio
+import codecs
+from collections import deque
+import csv
+import functools
+import gzip
+import hashlib
+import importlib.util
+import inspect
+import itertools
 import json
 import io
 import time
+from contextlib import asynccontextmanager
 from typing import Optional
 import os
 from datetime import datetime
 import re
+import tempfile
+import threading
+# openai, sentence-transformers and faiss are slow to import, so only check that
+# they are installed here and import them on first use
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
+    import diskcache
+    DISKCACHE_AVAILABLE = True
 except ImportError:
-    OPENAI_AVAILABLE = False
+    DISKCACHE_AVAILABLE = False
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# pandas imports the calamine reader itself, so only its presence is checked here
+CALAMINE_AVAILABLE = importlib.util.find_spec("python_calamine") is not None
+
+try:
+    import xlsxwriter
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    XLSXWRITER_AVAILABLE = False
+
+try:
+    from charset_normalizer import from_bytes
+    CHARSET_NORMALIZER_AVAILABLE = True
+except ImportError:
+    CHARSET_NORMALIZER_AVAILABLE = False
+
+SEMANTIC_CACHE_AVAILABLE = (importlib.util.find_spec("faiss") is not None and
+                            importlib.util.find_spec("sentence_transformers") is not None)
+
+RESPONSE_CACHE_DIR = ".llm_cache"
+RESPONSE_CACHE_TTL = 7 * 86400  # one week, in seconds
+SEMANTIC_CACHE_DIR = ".semantic_cache"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.92  # default minimum cosine similarity for a semantic cache hit
+ENCODING_SAMPLE_SIZE = 64 * 1024  # bytes sampled for encoding detection
+CSV_CHUNK_SIZE = 50_000  # rows parsed per chunk when loading CSV files
+EXPORT_CHUNK_SIZE = 10_000  # rows serialized per chunk when building downloads
+CSV_GZIP_LEVEL = 3  # fast gzip level for the compressed CSV download
+RESULTS_PREVIEW_ROWS = 500  # rows of the processed data sent to the browser in the results table
+LIVE_TABLE_ROWS = 50  # most recently finished rows shown while processing
+# Arrow strings keep text in contiguous buffers and run .str methods in PyArrow kernels
+TEXT_DTYPE = "string[pyarrow]" if PYARROW_AVAILABLE else str
+OLLAMA_KEEP_ALIVE = "30m"  # keep model weights loaded between rows
+OLLAMA_OPTIONS = {"num_predict": 400, "temperature": 0.3, "num_ctx": 4096}  # cap reply length and KV cache per row
+OPENAI_BATCH_THRESHOLD = 50  # below this many rows the Batch API is not worth the wait
+OPENAI_MAX_TOKENS = 2000  # completion cap per request; OpenAI counts it against the token rate limit
+AGENT_NOTES_RE = re.compile(r"(?=.*agent)(?=.*note)", re.IGNORECASE | re.DOTALL)  # auto-selected column
+_DROP_CTRL = str.maketrans('', '', '\r\x00')  # carriage returns and NUL bytes in pasted data
+# pandas 3 always copies on write; on 2.x opt in so shallow copies share untouched columns with the
+# input frame instead of being defensively copied when a column is added
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 
 # Page configuration
 st.set_page_config(
@@ -21,6 +92,18 @@ st.set_page_config(
     layout="wide"
 )
 
+def _get_openai():
+    """Import the openai package on first use (it pulls in pydantic, httpx and more)"""
+    import openai
+    return openai
+
+def make_openai_client(api_key: str, use_async: bool = False):
+    """OpenAI client speaking HTTP/2 when h2 is installed, so concurrent requests share one connection"""
+    openai = _get_openai()
+    if use_async:
+        return openai.AsyncOpenAI(api_key=api_key, http_client=openai.DefaultAsyncHttpxClient(http2=HTTP2_AVAILABLE))
+    return openai.OpenAI(api_key=api_key, http_client=openai.DefaultHttpxClient(http2=HTTP2_AVAILABLE))
+
 def generate_filename(base_name: str, extension: str) -> str:
     """Generate a filename with datetime format"""
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -93,26 +176,251 @@ def de_anonymize_data(text: str, anonymization_map: dict) -> str:
         de_anonymized_text = de_anonymized_text.replace(placeholder, original)
     return de_anonymized_text
 
+def cached_response(func):
+    """Anonymize the text, then serve repeated requests from the processor's exact and semantic caches
+    
+    func receives the anonymized text and returns the raw model output. Responses are cached with
+    their placeholders and de-anonymized with the current row's map, so a near-duplicate row never
+    gets another row's emails or phone numbers back.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, text, custom_prompt=None, enable_anonymization=False):
+            anonymized_text, anonymization_map = anonymize_data(text, enable_anonymization)
+            result, pending = self._cache_lookup(anonymized_text, custom_prompt, enable_anonymization)
+            if result is None:
+                result = await func(self, anonymized_text, custom_prompt)
+                self._cache_store(pending, result)
+            return de_anonymize_data(result, anonymization_map) if anonymization_map else result
+        return async_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(self, text, custom_prompt=None, enable_anonymization=False):
+        anonymized_text, anonymization_map = anonymize_data(text, enable_anonymization)
+        result, pending = self._cache_lookup(anonymized_text, custom_prompt, enable_anonymization)
+        if result is None:
+            result = func(self, anonymized_text, custom_prompt)
+            self._cache_store(pending, result)
+        return de_anonymize_data(result, anonymization_map) if anonymization_map else result
+    return wrapper
+
+@st.cache_resource
+def get_response_cache():
+    """Open the on-disk response cache shared by all sessions"""
+    return diskcache.Cache(RESPONSE_CACHE_DIR)
+
+class SemanticCache:
+    """Reuses LLM responses for near-duplicate texts based on embedding cosine similarity"""
+    
+    def __init__(self, model, cache_dir: str = SEMANTIC_CACHE_DIR):
+        self.model = model
+        self.cache_dir = cache_dir
+        self._indexes = {}  # namespace -> (faiss index, cached responses)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _paths(self, namespace: str) -> tuple[str, str]:
+        base = os.path.join(self.cache_dir, namespace)
+        return f"{base}.faiss", f"{base}.json"
+    
+    def _load(self, namespace: str):
+        """Get the index for a namespace, reading it from disk on first use"""
+        import faiss
+        
+        if namespace not in self._indexes:
+            index_path, responses_path = self._paths(namespace)
+            if os.path.exists(index_path) and os.path.exists(responses_path):
+                index = faiss.read_index(index_path)
+                with open(responses_path, encoding="utf-8") as f:
+                    responses = json.load(f)
+            else:
+                # Embeddings are normalized, so inner product == cosine similarity
+                index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+                responses = []
+            self._indexes[namespace] = (index, responses)
+        return self._indexes[namespace]
+    
+    def embed(self, text: str) -> np.ndarray:
+        return np.asarray(self.model.encode([text], normalize_embeddings=True), dtype="float32")
+    
+    def lookup(self, namespace: str, embedding: np.ndarray, threshold: float = SEMANTIC_THRESHOLD) -> Optional[str]:
+        """Return the cached response of the nearest neighbour if its similarity reaches threshold"""
+        with self._lock:
+            index, responses = self._load(namespace)
+            if index.ntotal == 0:
+                return None
+            scores, ids = index.search(embedding, 1)
+            if scores[0][0] >= threshold:
+                return responses[ids[0][0]]
+            return None
+    
+    def add(self, namespace: str, embedding: np.ndarray, response: str):
+        with self._lock:
+            index, responses = self._load(namespace)
+            index.add(embedding)
+            responses.append(response)
+            self._dirty.add(namespace)
+    
+    def save(self):
+        """Persist every index that changed since the last save"""
+        import faiss
+        
+        with self._lock:
+            for namespace in self._dirty:
+                index, responses = self._indexes[namespace]
+                index_path, responses_path = self._paths(namespace)
+                faiss.write_index(index, index_path)
+                with open(responses_path, "w", encoding="utf-8") as f:
+                    json.dump(responses, f)
+            self._dirty.clear()
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_semantic_cache():
+    """Load the embedding model once and share the semantic cache across sessions"""
+    from sentence_transformers import SentenceTransformer
+    
+    return SemanticCache(SentenceTransformer(EMBEDDING_MODEL))
+
+class TokenRateLimiter:
+    """Holds requests back until they fit under per-minute request and token budgets"""
+    
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()  # (dispatch time, estimated tokens) over the last minute
+        self._lock = None
+        self._loop = None
+    
+    @staticmethod
+    def estimate_tokens(messages: list, max_tokens: int) -> int:
+        """Rough prompt size (~4 characters per token) plus the completion allowance"""
+        return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+    
+    async def acquire(self, tokens: int):
+        """Wait until one more request of this size stays under both limits, then record it"""
+        # Each asyncio.run() has its own loop, and a lock cannot be shared between loops
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        
+        tokens = min(tokens, self.tokens_per_minute)
+        # Waiters queue on the lock, so requests are released one by one instead of in bursts
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    self._window.popleft()
+                used = sum(window_tokens for _, window_tokens in self._window)
+                if len(self._window) < self.requests_per_minute and used + tokens <= self.tokens_per_minute:
+                    self._window.append((now, tokens))
+                    return
+                await asyncio.sleep(60 - (now - self._window[0][0]))
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive session for every Ollama call, shared across browser sessions"""
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Retry POSTs too: the streamed /api/chat requests and the /api/generate warm-up are
+        # stateless, and a retry only happens on a failed connect or an error status, before any
+        # of a streamed reply has been read
+        allowed_methods=None,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retries)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(key_hash: str, _api_key: str):
+    """One OpenAI client (and its connection pool) per API key instead of a new one every rerun"""
+    return make_openai_client(_api_key)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def fetch_ollama_status(base_url: str, _session: requests.Session) -> bool:
+    """Check if Ollama is running; cached so widget reruns don't hit the network"""
+    try:
+        response = _session.get(f"{base_url}/api/tags", timeout=5)
+        return response.status_code == 200
+    except:
+        return False
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_ollama_models(base_url: str, _session: requests.Session) -> list:
+    """List the models pulled into Ollama; cached so widget reruns don't hit the network"""
+    try:
+        response = _session.get(f"{base_url}/api/tags", timeout=5)
+        if response.status_code == 200:
+            data = response.json()
+            return [model['name'] for model in data.get('models', [])]
+        return []
+    except:
+        return []
+
 class LLMProcessor:
     """Handles communication with LLMs via Ollama or OpenAI"""
     
-    def __init__(self, model_name: str = "llama2", base_url: str = "http://localhost:11434", provider: str = "ollama", openai_api_key: str = None):
+    PROMPT_PREFIX = """The inputted text is unorganized and contains lots of irrelevant information. Remove all the noise except the main story of the call.
+
+Please provide a clean, concise summary of what actually happened in this customer service interaction. Focus only on the essential facts and ignore system text, repetitive information, and irrelevant details."""
+    
+    def __init__(self, model_name: str = "llama2", base_url: str = "http://localhost:11434", provider: str = "ollama", openai_api_key: str = None,
+                 session: requests.Session = None):
         self.model_name = model_name
         self.base_url = base_url
         self.provider = provider
         self.openai_api_key = openai_api_key
         self.openai_client = None
+        self._async_http = None
+        self._async_openai = None
+        self.response_cache = None
+        self.semantic_cache = None
+        self.semantic_threshold = SEMANTIC_THRESHOLD
+        self.cache_hits = 0
+        self.semantic_hits = 0
+        self.cache_misses = 0
+        self.tokens_used = 0
+        self.rate_limiter = TokenRateLimiter(requests_per_minute=500, tokens_per_minute=90_000)
+        self._warmed_models = set()
+        self._session = session if session is not None else get_http_session()
         
         if self.provider == "openai" and self.openai_api_key and OPENAI_AVAILABLE:
-            self.openai_client = OpenAI(api_key=self.openai_api_key)
+            self.openai_client = make_openai_client(self.openai_api_key)
         
     def is_ollama_running(self) -> bool:
         """Check if Ollama is running and accessible"""
+        return fetch_ollama_status(self.base_url, self._session)
+    
+    def warm_up(self):
+        """Load the selected Ollama model in the background so the first row skips the cold start"""
+        if self.provider != "ollama" or self.model_name in self._warmed_models:
+            return
+        self._warmed_models.add(self.model_name)
+        threading.Thread(target=self._load_ollama_model, args=(self.model_name,), daemon=True).start()
+    
+    def _load_ollama_model(self, model_name: str):
+        """An empty generate request makes Ollama load the model and keep it resident"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+            self._session.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": model_name,
+                    "prompt": "",
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "stream": False
+                },
+                timeout=120
+            )
+        except Exception:
+            # Warm-up is best effort; the first real request will load the model anyway
+            self._warmed_models.discard(model_name)
     
     def is_openai_available(self) -> bool:
         """Check if OpenAI API is available and configured"""
@@ -132,53 +440,108 @@ class LLMProcessor:
                 "gpt-3.5-turbo"
             ]
         else:  # ollama
-            try:
-                response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    return [model['name'] for model in data.get('models', [])]
-                return []
-            except:
-                return []
-    
-    def process_text(self, text: str, custom_prompt: str = None, enable_anonymization: bool = False) -> str:
-        """Process messy agent notes into clean, readable format"""
-        
-        # Anonymize data if enabled
-        anonymized_text, anonymization_map = anonymize_data(text, enable_anonymization)
-        
+            return fetch_ollama_models(self.base_url, self._session)
+    
+    def _build_messages(self, text: str, custom_prompt: str = None) -> list:
+        """Chat messages for the (already anonymized) text: the fixed instructions first, then the row"""
+        # Keeping the instructions in an identical leading system message lets Ollama and
+        # OpenAI reuse the cached prefix across rows
         if custom_prompt:
             # Use custom prompt provided by user
-            prompt = f"""{custom_prompt}
-
-Original text:
-{anonymized_text}
-
-Response:"""
-        else:
-            # Use default prompt
-            prompt = f"""The inputted text is unorganized and contains lots of irrelevant information. Remove all the noise except the main story of the call.
-
-Please provide a clean, concise summary of what actually happened in this customer service interaction. Focus only on the essential facts and ignore system text, repetitive information, and irrelevant details.
-
-Original messy text:
-{anonymized_text}
-
-Clean summary:"""
+            return [
+                {"role": "system", "content": custom_prompt},
+                {"role": "user", "content": f"Original text:\n{text}\n\nResponse:"}
+            ]
+        # Use default prompt
+        return [
+            {"role": "system", "content": self.PROMPT_PREFIX},
+            {"role": "user", "content": f"Original messy text:\n{text}\n\nClean summary:"}
+        ]
+    
+    def _cache_lookup(self, text: str, custom_prompt: str, enable_anonymization: bool):
+        """Check the exact then the semantic cache for the (anonymized) text; returns (cached response, pending store)"""
+        if self.response_cache is None and self.semantic_cache is None:
+            return None, None
+        
+        namespace = {
+            "provider": self.provider,
+            "model": self.model_name,
+            "prompt": custom_prompt or "__default__",
+            # Anonymized responses are stored with placeholders; the distinct value keeps entries
+            # written before that (holding real values) out of reach
+            "anonymize": "placeholders" if enable_anonymization else False,
+        }
+        key = semantic_namespace = embedding = None
+        
+        if self.response_cache is not None:
+            key = hashlib.sha256(json.dumps({**namespace, "text": text}, sort_keys=True).encode()).hexdigest()
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached, None
+        
+        if self.semantic_cache is not None:
+            semantic_namespace = hashlib.sha256(json.dumps(namespace, sort_keys=True).encode()).hexdigest()
+            embedding = self.semantic_cache.embed(text)
+            cached = self.semantic_cache.lookup(semantic_namespace, embedding, self.semantic_threshold)
+            if cached is not None:
+                self.semantic_hits += 1
+                if key is not None:
+                    self.response_cache.set(key, cached, expire=RESPONSE_CACHE_TTL)
+                return cached, None
+        
+        self.cache_misses += 1
+        return None, (key, semantic_namespace, embedding)
+    
+    def _cache_store(self, pending, result: str):
+        """Cache a fresh response unless it is an error message"""
+        if pending is None or result.startswith("Error"):
+            return
+        key, semantic_namespace, embedding = pending
+        if key is not None and self.response_cache is not None:
+            self.response_cache.set(key, result, expire=RESPONSE_CACHE_TTL)
+        if embedding is not None and self.semantic_cache is not None:
+            self.semantic_cache.add(semantic_namespace, embedding, result)
+    
+    @cached_response
+    def process_text(self, text: str, custom_prompt: str = None) -> str:
+        """Process messy agent notes into clean, readable format
+        
+        Called as process_text(text, custom_prompt, enable_anonymization); cached_response
+        anonymizes the text before it gets here and de-anonymizes the result.
+        """
+        messages = self._build_messages(text, custom_prompt)
 
         # Process with LLM
         if self.provider == "openai":
-            processed_result = self._process_with_openai(prompt)
-        else:
-            processed_result = self._process_with_ollama(prompt)
-        
-        # De-anonymize the result if anonymization was used
-        if enable_anonymization and anonymization_map:
-            processed_result = de_anonymize_data(processed_result, anonymization_map)
+            return self._process_with_openai(messages)
+        return self._process_with_ollama(messages)
+    
+    @cached_response
+    async def aprocess_text(self, text: str, custom_prompt: str = None) -> str:
+        """Async variant of process_text; must be awaited inside an async_clients() block"""
+        messages = self._build_messages(text, custom_prompt)
         
-        return processed_result
+        if self.provider == "openai":
+            return await self._aprocess_with_openai(messages)
+        return await self._aprocess_with_ollama(messages)
     
-    def _process_with_openai(self, prompt: str) -> str:
+    @asynccontextmanager
+    async def async_clients(self):
+        """Open one pooled async HTTP/OpenAI client shared by every aprocess_text call in the block"""
+        self._async_http = httpx.AsyncClient(timeout=60)
+        if self.provider == "openai" and self.openai_api_key and OPENAI_AVAILABLE:
+            self._async_openai = make_openai_client(self.openai_api_key, use_async=True)
+        try:
+            yield self
+        finally:
+            await self._async_http.aclose()
+            self._async_http = None
+            if self._async_openai is not None:
+                await self._async_openai.close()
+                self._async_openai = None
+    
+    def _process_with_openai(self, messages: list) -> str:
         """Process text using OpenAI API"""
         try:
             if not self.is_openai_available():
@@ -186,48 +549,306 @@ Clean summary:"""
             
             response = self.openai_client.chat.completions.create(
                 model=self.model_name,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
                 temperature=0.3
             )
             
+            if response.usage is not None:
+                self.tokens_used += response.usage.total_tokens
             return response.choices[0].message.content.strip()
             
         except Exception as e:
             return f"Error with OpenAI API: {str(e)}"
     
-    def _process_with_ollama(self, prompt: str) -> str:
-        """Process text using Ollama"""
+    def _ollama_chat_request(self, messages: list) -> dict:
+        """Streaming /api/chat payload with capped generation length"""
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "stream": True,
+            "options": OLLAMA_OPTIONS
+        }
+    
+    @staticmethod
+    def _read_ollama_chunk(line, parts: list) -> bool:
+        """Accumulate one streamed chat delta into parts; returns True once Ollama reports done"""
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise RuntimeError(chunk["error"])
+        parts.append(chunk.get("message", {}).get("content", ""))
+        return chunk.get("done", False)
+    
+    def _process_with_ollama(self, messages: list) -> str:
+        """Process text using Ollama, reading the streamed reply as it is generated"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False
-                },
+            with self._session.post(
+                f"{self.base_url}/api/chat",
+                json=self._ollama_chat_request(messages),
+                stream=True,
                 timeout=60
-            )
+            ) as response:
+                if response.status_code != 200:
+                    return f"Error: HTTP {response.status_code}"
+                
+                parts = []
+                for line in response.iter_lines():
+                    if line and self._read_ollama_chunk(line, parts):
+                        break
             
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', 'Error: No response received')
-            else:
-                return f"Error: HTTP {response.status_code}"
+            return "".join(parts) or 'Error: No response received'
                 
         except requests.exceptions.Timeout:
             return "Error: Request timed out"
         except Exception as e:
             return f"Error: {str(e)}"
+    
+    def process_batch(self, texts: list, custom_prompt: str = None, enable_anonymization: bool = False,
+                      poll_interval: int = 30, on_status=None) -> list:
+        """Process texts with the OpenAI Batch API (50% cheaper, completes within 24h)"""
+        if not self.is_openai_available():
+            return ["Error: OpenAI not configured properly"] * len(texts)
+        
+        # Cached rows are answered up front; the rest become one chat completion request each,
+        # matched back to its row by custom_id
+        results = [None] * len(texts)
+        anonymization_maps = []
+        pending_stores = {}
+        requests_jsonl = []
+        for i, text in enumerate(texts):
+            anonymized_text, anonymization_map = anonymize_data(text, enable_anonymization)
+            anonymization_maps.append(anonymization_map)
+            cached, pending = self._cache_lookup(anonymized_text, custom_prompt, enable_anonymization)
+            if cached is not None:
+                results[i] = de_anonymize_data(cached, anonymization_map) if anonymization_map else cached
+                continue
+            pending_stores[i] = pending
+            requests_jsonl.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model_name,
+                    "messages": self._build_messages(anonymized_text, custom_prompt),
+                    "max_tokens": OPENAI_MAX_TOKENS,
+                    "temperature": 0.3
+                }
+            }))
+        
+        if not requests_jsonl:
+            return results
+        
+        try:
+            batch_file = self.openai_client.files.create(
+                file=("batch_input.jsonl", "\n".join(requests_jsonl).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = self.openai_client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                if on_status:
+                    on_status(batch)
+                time.sleep(poll_interval)
+                batch = self.openai_client.batches.retrieve(batch.id)
+            if on_status:
+                on_status(batch)
+            
+            if batch.status != "completed" or not batch.output_file_id:
+                return [f"Error: OpenAI batch {batch.status}" if r is None else r for r in results]
+            
+            output = self.openai_client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                i = int(record["custom_id"])
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    body = response["body"]
+                    self.tokens_used += (body.get("usage") or {}).get("total_tokens", 0)
+                    content = body["choices"][0]["message"]["content"].strip()
+                    # Cached with placeholders, like cached_response does for interactive rows
+                    self._cache_store(pending_stores.get(i), content)
+                    if anonymization_maps[i]:
+                        content = de_anonymize_data(content, anonymization_maps[i])
+                    results[i] = content
+                else:
+                    results[i] = f"Error with OpenAI API: {record.get('error') or response.get('status_code')}"
+            return ["Error: No response received" if r is None else r for r in results]
+            
+        except Exception as e:
+            return [f"Error with OpenAI API: {str(e)}" if r is None else r for r in results]
+        finally:
+            if self.semantic_cache is not None:
+                self.semantic_cache.save()
+    
+    async def _aprocess_with_openai(self, messages: list) -> str:
+        """Process text using the async OpenAI client"""
+        try:
+            if not self.is_openai_available() or self._async_openai is None:
+                return "Error: OpenAI not configured properly"
+            
+            # Throttle before dispatch so bursts don't end in 429s and serialized retries
+            await self.rate_limiter.acquire(TokenRateLimiter.estimate_tokens(messages, OPENAI_MAX_TOKENS))
+            response = await self._async_openai.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=0.3
+            )
+            
+            if response.usage is not None:
+                self.tokens_used += response.usage.total_tokens
+            return response.choices[0].message.content.strip()
+            
+        except Exception as e:
+            return f"Error with OpenAI API: {str(e)}"
+    
+    async def _aprocess_with_ollama(self, messages: list) -> str:
+        """Process text using Ollama over the shared async HTTP client"""
+        try:
+            async with self._async_http.stream(
+                "POST",
+                f"{self.base_url}/api/chat",
+                json=self._ollama_chat_request(messages),
+                timeout=60
+            ) as response:
+                if response.status_code != 200:
+                    return f"Error: HTTP {response.status_code}"
+                
+                parts = []
+                async for line in response.aiter_lines():
+                    if line and self._read_ollama_chunk(line, parts):
+                        break
+            
+            return "".join(parts) or 'Error: No response received'
+                
+        except httpx.TimeoutException:
+            return "Error: Request timed out"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+async def _run_batch(llm: LLMProcessor, texts: dict, custom_prompt: str, enable_anonymization: bool,
+                     max_concurrency: int, on_result) -> None:
+    """Send texts ({row index: text}) to the LLM concurrently, calling on_result(i, result) as each finishes"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run_one(i: int, text: str):
+        async with semaphore:
+            return i, await llm.aprocess_text(text, custom_prompt, enable_anonymization)
+    
+    async with llm.async_clients():
+        for next_done in asyncio.as_completed([run_one(i, text) for i, text in texts.items()]):
+            i, processed_text = await next_done
+            on_result(i, processed_text)
+    
+    if llm.semantic_cache is not None:
+        llm.semantic_cache.save()
+
+def detect_encoding(sample: bytes) -> Optional[str]:
+    """Guess the encoding of a byte sample from its BOM, UTF-8 validity or UTF-16/32 NUL pattern, else None
+
+    Legacy single-byte and CJK files are left to the caller's trial list; the upload debug panel
+    shows charset_normalizer's best guess for those instead.
+    """
+    # A byte-order mark settles the question without running a detector
+    if sample.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+        return "utf-32"
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    
+    # Plain ASCII and valid UTF-8 cover most files and need no detector
+    if b"\x00" not in sample:
+        try:
+            # A sample cut mid-character is fine as long as everything before it decodes
+            codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+            return "utf-8"
+        except UnicodeDecodeError:
+            # Legacy single-byte files (mostly cp1252) go to the ordered trial list; detectors
+            # misread short accented Latin text as cp1250 or big5 and load mojibake silently
+            return None
+    
+    # NUL bytes are valid UTF-8 but point to BOM-less UTF-16/32, which only a detector can tell apart
+    if not CHARSET_NORMALIZER_AVAILABLE:
+        return None
+    best = from_bytes(sample).best()
+    if best is None or not best.encoding.startswith(("utf_16", "utf_32")):
+        return None
+    return best.encoding
+
+def to_arrow_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Store columns as Arrow arrays (contiguous string buffers) when pyarrow is installed"""
+    if not PYARROW_AVAILABLE:
+        return df
+    return df.convert_dtypes(dtype_backend="pyarrow")
+
+def read_csv_chunked(file, encoding: str, **kwargs) -> pd.DataFrame:
+    """Parse a CSV in CSV_CHUNK_SIZE-row chunks so the parser never buffers the whole file at once"""
+    if PYARROW_AVAILABLE:
+        kwargs.setdefault("dtype_backend", "pyarrow")
+    chunks = list(pd.read_csv(file, encoding=encoding, chunksize=CSV_CHUNK_SIZE, **kwargs))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def read_csv_fast(file, encoding: str) -> pd.DataFrame:
+    """Parse a CSV with Arrow's multithreaded reader, falling back to the chunked C parser"""
+    if PYARROW_AVAILABLE:
+        try:
+            file.seek(0)
+            df = pd.read_csv(file, encoding=encoding, engine="pyarrow", dtype_backend="pyarrow")
+            # Arrow keeps bytes it cannot decode as binary columns instead of failing
+            if not any(pyarrow.types.is_binary(dtype.pyarrow_dtype) or pyarrow.types.is_large_binary(dtype.pyarrow_dtype)
+                       for dtype in df.dtypes):
+                return df
+        except Exception:
+            pass
+        # Let the C parser raise the usual UnicodeDecodeError / ParserError for this encoding
+        file.seek(0)
+    return read_csv_chunked(file, encoding)
+
+def read_excel_fast(uploaded_file) -> pd.DataFrame:
+    """Read an Excel file with the Rust calamine engine, falling back to pandas' default engine"""
+    if CALAMINE_AVAILABLE:
+        try:
+            uploaded_file.seek(0)
+            return pd.read_excel(uploaded_file, engine="calamine")
+        except Exception as e:
+            st.write(f"🔍 **Debug:** calamine engine failed - {str(e)[:100]}...")
+    uploaded_file.seek(0)
+    # pandas opens .xlsx files with openpyxl in read-only, data-only mode
+    return pd.read_excel(uploaded_file)
 
 def load_file(uploaded_file) -> Optional[pd.DataFrame]:
     """Load Excel or CSV file into pandas DataFrame with encoding detection"""
     try:
         if uploaded_file.name.endswith('.csv'):
             st.write("🔍 **Debug:** Attempting to load CSV file...")
-            # Try multiple encodings for CSV files
+            
+            # Detect the encoding once from a sample instead of re-parsing the file per candidate
+            uploaded_file.seek(0)
+            detected_encoding = detect_encoding(uploaded_file.read(ENCODING_SAMPLE_SIZE))
+            if detected_encoding:
+                st.write(f"🔍 **Debug:** Detected encoding: {detected_encoding}")
+                try:
+                    uploaded_file.seek(0)
+                    df = read_csv_fast(uploaded_file, detected_encoding)
+                    if len(df) == 0:
+                        st.warning(f"⚠️ File loaded with {detected_encoding} but appears to be empty")
+                        return None
+                    st.success(f"✅ File loaded successfully using {detected_encoding} encoding!")
+                    return df
+                except Exception as e:
+                    st.write(f"🔍 **Debug:** Detected encoding {detected_encoding} failed - {str(e)[:100]}...")
+            
+            # Fall back to trying common encodings one by one
             encodings_to_try = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252', 'iso-8859-1', 'gbk', 'big5']
             
             for i, encoding in enumerate(encodings_to_try):
@@ -235,7 +856,7 @@ def load_file(uploaded_file) -> Optional[pd.DataFrame]:
                     st.write(f"🔍 **Debug:** Trying encoding {i+1}/{len(encodings_to_try)}: {encoding}")
                     # Reset file pointer to beginning
                     uploaded_file.seek(0)
-                    df = pd.read_csv(uploaded_file, encoding=encoding)
+                    df = read_csv_fast(uploaded_file, encoding)
                     if len(df) == 0:
                         st.warning(f"⚠️ File loaded with {encoding} but appears to be empty")
                         return None
@@ -258,8 +879,15 @@ def load_file(uploaded_file) -> Optional[pd.DataFrame]:
                 uploaded_file.seek(0)
                 raw_content = uploaded_file.read()
                 
-                # Try to decode with different encodings for text
-                for encoding in ['gb2312', 'gb18030', 'shift_jis', 'euc-kr']:
+                # Take the encoding charset_normalizer scores as least chaotic rather than the first
+                # codec that happens not to raise, which for CJK bytes is often mojibake
+                if CHARSET_NORMALIZER_AVAILABLE:
+                    best = from_bytes(raw_content[:ENCODING_SAMPLE_SIZE]).best()
+                    fallback_encodings = [best.encoding] if best is not None else []
+                else:
+                    fallback_encodings = ['gb2312', 'gb18030', 'shift_jis', 'euc-kr']
+                
+                for encoding in fallback_encodings:
                     try:
                         text_content = raw_content.decode(encoding)
                         st.write(f"🔍 **Debug:** Successfully decoded text with {encoding}")
@@ -274,7 +902,7 @@ def load_file(uploaded_file) -> Optional[pd.DataFrame]:
                             st.warning(f"⚠️ File decoded with {encoding} but appears to be empty")
                             continue
                         st.warning(f"⚠️ File loaded using {encoding} encoding with flexible parsing (some bad lines may be skipped)")
-                        return df
+                        return to_arrow_dtypes(df)
                     except Exception as e:
                         st.write(f"🔍 **Debug:** {encoding} approach failed: {str(e)[:100]}...")
                         continue
@@ -285,12 +913,12 @@ def load_file(uploaded_file) -> Optional[pd.DataFrame]:
                 
         elif uploaded_file.name.endswith(('.xlsx', '.xls')):
             st.write("🔍 **Debug:** Attempting to load Excel file...")
-            df = pd.read_excel(uploaded_file)
+            df = read_excel_fast(uploaded_file)
             if len(df) == 0:
                 st.warning("⚠️ Excel file appears to be empty")
                 return None
             st.success("✅ Excel file loaded successfully!")
-            return df
+            return to_arrow_dtypes(df)
         else:
             st.error("Unsupported file format. Please upload CSV or Excel files.")
             return None
@@ -304,8 +932,16 @@ def load_file(uploaded_file) -> Optional[pd.DataFrame]:
                "- Or try the 'Paste data directly' option instead")
         return None
 
+def _separator_score(text: str, separator: str, sample_records: int = 20) -> int:
+    """How many of the first records split into as many cells as the header (0 if the header is one cell)"""
+    records = list(itertools.islice(csv.reader(io.StringIO(text), delimiter=separator), sample_records))
+    if not records or len(records[0]) < 2:
+        return 0
+    return sum(len(record) == len(records[0]) for record in records)
+
+@st.cache_data(show_spinner=False, max_entries=8)
 def parse_pasted_data(pasted_text: str) -> Optional[pd.DataFrame]:
-    """Parse pasted Excel cell data into pandas DataFrame with better character handling"""
+    """Parse pasted Excel cell data into pandas DataFrame; cached so re-parsing the same paste is instant"""
     try:
         if not pasted_text.strip():
             return None
@@ -317,61 +953,36 @@ def parse_pasted_data(pasted_text: str) -> Optional[pd.DataFrame]:
         except:
             cleaned_text = pasted_text
         
-        # Split into lines
-        lines = cleaned_text.strip().split('\n')
+        # Drop carriage returns and NUL bytes in one pass over the whole text
+        cleaned_text = cleaned_text.strip().translate(_DROP_CTRL)
         
-        # Try to detect separator (tab is most common from Excel copy)
-        sample_line = lines[0]
-        if '\t' in sample_line:
-            separator = '\t'
-        elif ',' in sample_line and sample_line.count(',') > sample_line.count('\t'):
-            separator = ','
-        else:
-            separator = '\t'  # Default to tab
-        
-        # Parse data
-        data = []
-        for line in lines:
-            # Clean each line and split
-            clean_line = line.strip()
-            if clean_line:  # Skip empty lines
-                row = clean_line.split(separator)
-                # Clean each cell to remove any problematic characters
-                cleaned_row = []
-                for cell in row:
-                    try:
-                        # Replace any problematic characters
-                        clean_cell = cell.strip().replace('\r', '').replace('\x00', '')
-                        cleaned_row.append(clean_cell)
-                    except:
-                        cleaned_row.append(str(cell).strip())
-                data.append(cleaned_row)
+        # Try to detect separator (tab is most common from Excel copy) from the first records, not
+        # lines, so commas inside quoted multi-line notes can't outvote the tabs between cells
+        tab_score = _separator_score(cleaned_text, '\t')
+        comma_score = _separator_score(cleaned_text, ',')
+        separator = ',' if comma_score > tab_score else '\t'  # Default to tab
+        
+        # The C csv reader is quote-aware, so quoted separators and multi-line cells
+        # copied from Excel stay in one cell; rows that are entirely empty are skipped
+        reader = csv.reader(io.StringIO(cleaned_text), delimiter=separator)
+        rows = [cells for row in reader if any(cells := [cell.strip() for cell in row])]
+        
+        # Ragged rows are padded with None, which becomes ''
+        df = pd.DataFrame(rows, dtype=TEXT_DTYPE).fillna('')
         
         # Create DataFrame
-        if len(data) > 0:
-            # Ensure all rows have the same number of columns
-            max_cols = max(len(row) for row in data)
-            for row in data:
-                while len(row) < max_cols:
-                    row.append('')
-            
+        if len(df) > 0:
             # Use first row as headers if it looks like headers, otherwise create generic headers
-            first_row = data[0]
-            has_headers = any(not str(cell).replace('.', '').replace('-', '').replace(' ', '').isdigit() 
-                            for cell in first_row if cell.strip())
+            first_row = df.iloc[0]
+            non_empty = first_row[first_row != '']
+            has_headers = (~non_empty.str.replace(r'[.\- ]', '', regex=True).str.isdigit()).any()
             
-            if has_headers and len(data) > 1:
-                df = pd.DataFrame(data[1:], columns=first_row)
+            if has_headers and len(df) > 1:
+                df.columns = first_row.tolist()
+                df = df.iloc[1:].reset_index(drop=True)
             else:
                 # Create generic column names
-                num_cols = len(data[0])
-                columns = [f"Column_{i+1}" for i in range(num_cols)]
-                df = pd.DataFrame(data, columns=columns)
-            
-            # Clean the DataFrame to remove any remaining problematic characters
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    df[col] = df[col].astype(str).str.replace('\r', '').str.replace('\x00', '').str.strip()
+                df.columns = [f"Column_{i+1}" for i in range(df.shape[1])]
             
             return df
         
@@ -385,6 +996,402 @@ def parse_pasted_data(pasted_text: str) -> Optional[pd.DataFrame]:
                "- Make sure you're copying from Excel correctly (select cells, Ctrl+C)")
         return None
 
+def process_rows(df: pd.DataFrame, selected_column: str, rows_to_process: int, custom_prompt: str,
+                 max_concurrency: int, key_prefix: str = "", batch_mode: bool = False,
+                 live_preview_rows: int = 3) -> list:
+    """Process the first rows of the selected column concurrently, showing live results as rows finish"""
+    # Create progress tracking
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    # Create containers for real-time display
+    st.subheader("🔄 Live Processing Results")
+    results_container = st.container()
+    # Finished rows accumulate in one table instead of a widget set per row
+    live_table = st.empty()
+    finished_rows, finished_originals, finished_outputs = [], [], []
+    
+    enable_anon = st.session_state.get('enable_anonymization', False)
+    
+    # Find empty rows with vectorized ops so only real work is scheduled
+    # The column is normalized (str + strip) once, so notes differing only in surrounding
+    # whitespace share one LLM call and one cache entry
+    column = df[selected_column].iloc[:rows_to_process]
+    column_text = column.astype(TEXT_DTYPE).str.strip()
+    empty_mask = (column.isna() | column_text.isin(['', 'nan'])).to_numpy()
+    work_idx = np.flatnonzero(~empty_mask)
+    pending = dict(zip(work_idx.tolist(), column_text.to_numpy()[work_idx]))
+    
+    processed_texts = ["No content to process"] * rows_to_process
+    completed = len(empty_mask) - len(work_idx)
+    last_progress = 0
+    # ~100 progress updates per run instead of one front-end message per row
+    progress_step = max(1, rows_to_process // 100)
+    
+    def show_row(i: int, original_text: str, processed_text: str):
+        finished_rows.append(i + 1)
+        finished_originals.append(original_text)
+        finished_outputs.append(processed_text)
+        # Only the first rows get side-by-side widgets; every row is listed in the live table
+        if i >= live_preview_rows:
+            return
+        with results_container:
+            with st.expander(f"Row {i+1}", expanded=i < 3):
+                col1, col2 = st.columns([1, 1])
+                with col1:
+                    st.markdown("**📝 Original Text:**")
+                    st.text_area("Original", original_text, height=200, disabled=True, key=f"orig_{key_prefix}{i}")
+                with col2:
+                    st.markdown("**🤖 LLM Output:**")
+                    st.text_area("Processed", processed_text, height=200, disabled=True, key=f"proc_{key_prefix}{i}")
+    
+    def on_result(text_id: int, processed_text: str):
+        # Every row sharing this text gets the same response
+        nonlocal completed, last_progress
+        for i in rows_by_text[unique_texts[text_id]]:
+            processed_texts[i] = processed_text
+            completed += 1
+            show_row(i, pending[i], processed_text)
+        if completed - last_progress >= progress_step or completed == rows_to_process:
+            last_progress = completed
+            status_text.text(f"Processed {completed} of {rows_to_process} rows...")
+            progress_bar.progress(completed / rows_to_process)
+            # Only the most recent rows, so each refresh costs the same however far the run has got
+            recent = slice(-LIVE_TABLE_ROWS, None)
+            live_table.dataframe(
+                pd.DataFrame({
+                    "Row": finished_rows[recent],
+                    "Original": finished_originals[recent],
+                    "Processed": finished_outputs[recent]
+                }),
+                width="stretch",
+                hide_index=True,
+                height=400
+            )
+    
+    # One collapsed summary for all empty rows instead of an expander per row
+    skipped_rows = np.flatnonzero(empty_mask)
+    if len(skipped_rows):
+        with results_container:
+            with st.expander(f"{len(skipped_rows)} empty rows skipped", expanded=False):
+                listed = 200  # keep the message short on very sparse columns
+                shown = ", ".join(str(i + 1) for i in skipped_rows[:listed])
+                more = f" and {len(skipped_rows) - listed} more" if len(skipped_rows) > listed else ""
+                st.info(f"No content to process in rows {shown}{more}")
+    
+    # Identical notes are only sent to the LLM once
+    rows_by_text = {}
+    for i, text in pending.items():
+        rows_by_text.setdefault(text, []).append(i)
+    unique_texts = list(rows_by_text)
+    if pending:
+        st.metric("Dedup savings", f"{1 - len(unique_texts) / len(pending):.0%}",
+                  help=f"{len(unique_texts)} unique texts across {len(pending)} non-empty rows")
+    
+    progress_bar.progress(completed / rows_to_process)
+    llm = st.session_state.llm_processor
+    if batch_mode and llm.provider == "openai" and len(unique_texts) > OPENAI_BATCH_THRESHOLD:
+        def on_status(batch):
+            counts = batch.request_counts
+            done = f" ({counts.completed}/{counts.total} requests done)" if counts else ""
+            status_text.text(f"OpenAI batch {batch.id}: {batch.status}{done}. Keep this page open...")
+        
+        results = llm.process_batch(unique_texts, custom_prompt, enable_anon, on_status=on_status)
+        for text_id, processed_text in enumerate(results):
+            on_result(text_id, processed_text)
+    else:
+        status_text.text(f"Processing {len(unique_texts)} unique texts with up to {max_concurrency} concurrent requests...")
+        asyncio.run(_run_batch(llm, dict(enumerate(unique_texts)), custom_prompt, enable_anon, max_concurrency, on_result))
+    
+    status_text.text("✅ Processing complete!")
+    return processed_texts
+
+def attach_processed_texts(df: pd.DataFrame, processed_texts: list, selected_column: str,
+                           create_new_column: bool, new_column_name: str = None) -> pd.DataFrame:
+    """Return df with the processed texts added, allocating only the column that is written"""
+    # A shallow copy shares every untouched column with df instead of duplicating the frame
+    processed_df = df.copy(deep=False)
+    if create_new_column:
+        # Rows past rows_to_process stay empty; stored as one contiguous Arrow string array,
+        # which the CSV export writes without a per-cell conversion
+        column = np.full(len(df), '', dtype=object)
+        column[:len(processed_texts)] = processed_texts
+        processed_df[new_column_name] = pd.array(column, dtype=TEXT_DTYPE)
+    elif PYARROW_AVAILABLE:
+        # New prefix + zero-copy slice of the original Arrow buffers, so only the processed rows are
+        # allocated and the column shared with df is never written to
+        original = pyarrow.array(processed_df[selected_column].astype(TEXT_DTYPE))
+        prefix = pyarrow.array(processed_texts, type=original.type)
+        chunks = pyarrow.chunked_array([prefix, original.slice(len(processed_texts))], type=original.type)
+        processed_df[selected_column] = pd.arrays.ArrowStringArray(chunks)
+    else:
+        # Replace the whole column so the shared original column is never written to
+        column = processed_df[selected_column].to_numpy(dtype=object, copy=True)
+        column[:len(processed_texts)] = processed_texts
+        processed_df[selected_column] = pd.array(column, dtype=TEXT_DTYPE)
+    return processed_df
+
+def read_download_file(download_file) -> bytes:
+    """Read a finished download back as bytes and close (and so delete) its temporary file"""
+    # st.download_button accepts bytes but not every temporary-file type (BufferedRandom on POSIX,
+    # a wrapper object on Windows), and it loads the payload into memory on click either way
+    with download_file:
+        download_file.seek(0)
+        return download_file.read()
+
+def with_numpy_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    """Swap Arrow timestamp columns for numpy datetimes, which to_csv writes as plain dates when all are midnight"""
+    if not PYARROW_AVAILABLE:
+        return df
+    timestamps = {}
+    for col, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.ArrowDtype) and pyarrow.types.is_timestamp(dtype.pyarrow_dtype):
+            unit, tz = dtype.pyarrow_dtype.unit, dtype.pyarrow_dtype.tz
+            timestamps[col] = pd.DatetimeTZDtype(unit, tz) if tz else f"datetime64[{unit}]"
+    return df.astype(timestamps) if timestamps else df
+
+def _arrow_csv_needs_quoting(table) -> bool:
+    """Whether any string cell would need CSV quotes (or a lone empty cell would, in a 1-column table)"""
+    if table.num_columns < 2:
+        # The csv module quotes a row whose only field is empty; Arrow writes a blank line
+        return True
+    return any(
+        pyarrow.compute.any(pyarrow.compute.match_substring_regex(column, r'[,"\r\n]')).as_py()
+        for column in table.columns
+        if pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type)
+    )
+
+def build_csv_file(processed_df: pd.DataFrame, compress: bool = False):
+    """Write the CSV download (gzipped if compress) to a temporary file and return its bytes"""
+    csv_file = tempfile.TemporaryFile()
+    # Both writers stream into the gzip wrapper, so the uncompressed CSV never exists in full
+    out = gzip.GzipFile(fileobj=csv_file, mode='wb', compresslevel=CSV_GZIP_LEVEL) if compress else csv_file
+    
+    table = None
+    if PYARROW_AVAILABLE:
+        try:
+            table = pyarrow.Table.from_pandas(processed_df, preserve_index=False)
+        except (pyarrow.ArrowException, TypeError, ValueError):
+            # Mixed-type object columns can't become Arrow arrays; pandas writes those
+            pass
+    
+    # Arrow formats floats (2.0 -> 2), booleans (true) and timestamps (.000000) differently from
+    # pandas, so only frames of text and integer columns take the fast path
+    if table is not None and all(
+        pyarrow.types.is_string(t) or pyarrow.types.is_large_string(t) or
+        pyarrow.types.is_integer(t) or pyarrow.types.is_null(t)
+        for t in table.schema.types
+    ) and not _arrow_csv_needs_quoting(table):
+        # Arrow quotes every string (header included) even in "needed" mode, so the header goes
+        # through the csv module and the rows are written unquoted, matching pandas' minimal quoting
+        header = io.StringIO()
+        csv.writer(header, lineterminator='\n').writerow(table.column_names)
+        out.write(header.getvalue().encode('utf-8'))
+        # Arrow's C++ writer serializes whole column buffers, far faster than pandas' row writer
+        pyarrow.csv.write_csv(table, out, write_options=pyarrow.csv.WriteOptions(
+            include_header=False, quoting_style="none"))
+    else:
+        with_numpy_timestamps(processed_df).to_csv(out, index=False, encoding='utf-8', lineterminator='\n', chunksize=EXPORT_CHUNK_SIZE)
+    
+    if compress:
+        out.close()  # writes the gzip trailer; csv_file itself stays open
+    return read_download_file(csv_file)
+
+def build_excel_file(processed_df: pd.DataFrame):
+    """Write the Excel download row by row, with xlsxwriter in constant-memory mode when available"""
+    excel_file = tempfile.TemporaryFile()
+    
+    if XLSXWRITER_AVAILABLE:
+        # constant_memory flushes each row to disk once the next one starts, so rows must be
+        # written strictly in order (pandas' to_excel writes column by column and loses cells)
+        workbook = xlsxwriter.Workbook(excel_file, {
+            'constant_memory': True,
+            # LLM output is plain text: never turn "=..." into formulas or links into hyperlinks
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+            'remove_timezone': True
+        })
+        sheet = workbook.add_worksheet('Processed Data')
+        sheet.write_row(0, 0, [str(col) for col in processed_df.columns])
+        for row_number, row in enumerate(processed_df.itertuples(index=False, name=None), start=1):
+            sheet.write_row(row_number, 0, [None if pd.isna(value) else value for value in row])
+        workbook.close()
+        return read_download_file(excel_file)
+    
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Processed Data')
+    sheet.append([str(col) for col in processed_df.columns])
+    for row in processed_df.itertuples(index=False, name=None):
+        sheet.append([None if pd.isna(value) else value for value in row])
+    
+    workbook.save(excel_file)
+    return read_download_file(excel_file)
+
+def unique_column_names(columns) -> list:
+    """Column names as non-empty, unique strings ('Unnamed: N' for blanks, '.1' suffixes for repeats)"""
+    names = []
+    seen = set()
+    for position, column in enumerate(columns):
+        name = str(column).strip() if column is not None and not pd.isna(column) else ''
+        base = name or f"Unnamed: {position}"
+        name, repeat = base, 0
+        while name in seen:
+            repeat += 1
+            name = f"{base}.{repeat}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+def build_parquet_file(processed_df: pd.DataFrame):
+    """Write the Parquet download (zstd-compressed) to a temporary file and return its bytes"""
+    # Parquet rejects repeated column names, which ragged pasted data produces as blank headers
+    processed_df = processed_df.set_axis(unique_column_names(processed_df.columns), axis=1)
+    parquet_file = tempfile.TemporaryFile()
+    try:
+        processed_df.to_parquet(parquet_file, engine='pyarrow', compression='zstd', index=False)
+    except (pyarrow.ArrowException, TypeError, ValueError):
+        # Mixed-type object columns have no single Arrow type, so store them as text
+        parquet_file.seek(0)
+        parquet_file.truncate()
+        mixed_columns = processed_df.select_dtypes(include='object').columns
+        processed_df.astype({col: TEXT_DTYPE for col in mixed_columns}).to_parquet(
+            parquet_file, engine='pyarrow', compression='zstd', index=False)
+    return read_download_file(parquet_file)
+
+def show_results_table(processed_df: pd.DataFrame):
+    """Show the first RESULTS_PREVIEW_ROWS rows; the downloads carry the full result"""
+    # Streamlit serializes the whole frame to Arrow for the browser, so large results are clipped
+    st.dataframe(processed_df.head(RESULTS_PREVIEW_ROWS), width="stretch", height=300)
+    if len(processed_df) > RESULTS_PREVIEW_ROWS:
+        st.caption(f"Showing the first {RESULTS_PREVIEW_ROWS:,} of {len(processed_df):,} rows. Download the results to see every row.")
+
+def render_downloads(processed_df: pd.DataFrame):
+    """Show the download buttons; each file is only built when its button is clicked"""
+    st.subheader("💾 Download Results")
+    
+    # Parquet needs pyarrow, so its button only appears when it is installed
+    columns = st.columns(3 if PYARROW_AVAILABLE else 2)
+    col1, col2 = columns[:2]
+    
+    with col1:
+        st.download_button(
+            label="📥 Download as CSV",
+            data=lambda: build_csv_file(processed_df),
+            file_name=generate_filename("processed_data", "csv"),
+            mime="text/csv",
+            on_click="ignore"
+        )
+        st.download_button(
+            label="📥 Download as CSV (gzip)",
+            data=lambda: build_csv_file(processed_df, compress=True),
+            file_name=generate_filename("processed_data", "csv.gz"),
+            mime="application/gzip",
+            on_click="ignore"
+        )
+    
+    with col2:
+        st.download_button(
+            label="📥 Download as Excel",
+            data=lambda: build_excel_file(processed_df),
+            file_name=generate_filename("processed_data", "xlsx"),
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
+        )
+    
+    if PYARROW_AVAILABLE:
+        with columns[2]:
+            st.download_button(
+                label="📥 Download as Parquet",
+                data=lambda: build_parquet_file(processed_df),
+                file_name=generate_filename("processed_data", "parquet"),
+                mime="application/octet-stream",
+                on_click="ignore"
+            )
+
+def render_usage_stats(llm: LLMProcessor):
+    """Cache hits/misses and OpenAI tokens used so far in this session"""
+    if llm.response_cache is not None or llm.semantic_cache is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Cache hits", llm.cache_hits + llm.semantic_hits)
+        with col2:
+            st.metric("Cache misses", llm.cache_misses)
+        if llm.semantic_cache is not None:
+            st.caption(f"{llm.semantic_hits} of the hits came from the semantic cache")
+    
+    if llm.provider == "openai" and llm.tokens_used:
+        st.metric("Tokens used this session", f"{llm.tokens_used:,}")
+
+@functools.lru_cache(maxsize=32)
+def detect_notes_column(columns: tuple) -> Optional[str]:
+    """First column whose name mentions both 'agent' and 'note'; cached since every rerun asks again"""
+    return next((col for col in columns if AGENT_NOTES_RE.search(str(col))), None)
+
+@st.fragment
+def processing_panel(df: pd.DataFrame, selected_column: str, provider: str, provider_ready: bool,
+                     max_concurrency: int, batch_mode: bool, live_preview_rows: int, key: str):
+    """Prompt, options and processing for one data source; its widgets rerun only this fragment"""
+    # Editing the prompt or options, or starting a run, skips re-reading and re-parsing the input
+    row_key_prefix = "" if key == "file" else f"{key}_"
+    
+    # Custom prompt input
+    st.subheader("🎯 Custom Prompt (Optional)")
+    custom_prompt = st.text_area(
+        "Enter a custom prompt for the LLM to follow (e.g., 'Summarize this call in 50 words or less. Only include key points.'). Leave empty for default prompt.",
+        height=100,
+        help="Customize how the AI processes your data. The original text will be automatically appended to your prompt.",
+        key=f"{key}_custom_prompt"
+    )
+    
+    # Processing options
+    st.subheader("🔧 Processing Options")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        process_all = st.checkbox("Process all rows", value=False, key=f"{key}_process_all")
+        if not process_all:
+            max_rows = st.number_input("Number of rows to process:", min_value=1, max_value=len(df), value=min(10, len(df)), key=f"{key}_max_rows")
+        else:
+            max_rows = len(df)
+    
+    with col2:
+        create_new_column = st.checkbox("Create new column for processed text", value=True, key=f"{key}_new_column")
+        if create_new_column:
+            new_column_name = st.text_input("New column name:", value="agent_notes_processed", key=f"{key}_column_name")
+    
+    # Process button
+    if st.button("🚀 Start Processing", type="primary", disabled=not provider_ready, key=f"{key}_process_button"):
+        if not provider_ready:
+            if provider == "ollama":
+                st.error("Please start Ollama first!")
+            else:
+                st.error("Please configure OpenAI API key first!")
+            return
+        
+        # Process data
+        rows_to_process = min(max_rows, len(df))
+        processed_texts = process_rows(df, selected_column, rows_to_process, custom_prompt, max_concurrency, key_prefix=row_key_prefix, batch_mode=batch_mode, live_preview_rows=live_preview_rows)
+        
+        # Add processed text to dataframe
+        processed_df = attach_processed_texts(df, processed_texts, selected_column, create_new_column, new_column_name if create_new_column else None)
+        # The column holds its own copy now; free the list before the downloads are built
+        del processed_texts
+        
+        st.success(f"Successfully processed {rows_to_process} rows!")
+        
+        # Show final results summary
+        st.subheader("📊 Final Results Summary")
+        show_results_table(processed_df)
+        
+        # Download options
+        render_downloads(processed_df)
+    
+    # Shown here rather than in the sidebar: a run only reruns this fragment, so sidebar numbers would stay stale
+    render_usage_stats(st.session_state.llm_processor)
+
 def main():
     st.title("🤖 LLM Excel/CSV Processor")
     st.markdown("Upload your Excel or CSV file to clean up messy agent notes using local LLM or OpenAI")
@@ -408,6 +1415,9 @@ def main():
         # Update processor if provider changed
         if provider != st.session_state.llm_processor.provider:
             st.session_state.llm_processor.provider = provider
+            # Switching back to Ollama should show its current state, not one from before the switch
+            fetch_ollama_status.clear()
+            fetch_ollama_models.clear()
         
         st.divider()
         
@@ -427,10 +1437,81 @@ def main():
         
         st.divider()
         
+        # Performance Settings
+        st.subheader("⚡ Performance")
+        max_concurrency = st.slider(
+            "Max concurrent requests",
+            min_value=1,
+            max_value=32,
+            value=8,
+            help="Number of rows sent to the LLM at the same time. Higher values finish faster but put more load on Ollama / your OpenAI rate limit."
+        )
+        live_preview_rows = st.slider(
+            "Live preview rows",
+            min_value=0,
+            max_value=20,
+            value=3,
+            help="Show side-by-side results for the first rows while processing. Every finished row is also listed in the live results table."
+        )
+        
+        enable_response_cache = st.checkbox(
+            "Enable response cache",
+            value=DISKCACHE_AVAILABLE,
+            disabled=not DISKCACHE_AVAILABLE,
+            help="Reuse stored LLM responses for rows that were already processed with the same model and prompt."
+        )
+        if not DISKCACHE_AVAILABLE:
+            st.caption("Install `diskcache` to enable the response cache: `pip install diskcache`")
+        
+        if enable_response_cache and DISKCACHE_AVAILABLE:
+            st.session_state.llm_processor.response_cache = get_response_cache()
+        else:
+            st.session_state.llm_processor.response_cache = None
+        
+        enable_semantic_cache = st.checkbox(
+            "Enable semantic cache",
+            value=False,
+            disabled=not SEMANTIC_CACHE_AVAILABLE,
+            help="Reuse the stored response of a near-duplicate note (e.g. canned scripts) instead of calling the LLM again."
+        )
+        if not SEMANTIC_CACHE_AVAILABLE:
+            st.caption("Install `sentence-transformers` and `faiss-cpu` to enable the semantic cache: `pip install sentence-transformers faiss-cpu`")
+        
+        if enable_semantic_cache and SEMANTIC_CACHE_AVAILABLE:
+            similarity_threshold = st.slider(
+                "Similarity threshold",
+                min_value=0.80,
+                max_value=0.99,
+                value=SEMANTIC_THRESHOLD,
+                step=0.01,
+                help="Minimum cosine similarity for two notes to share a response. Lower values save more calls but risk mismatched summaries."
+            )
+            # The cache object is shared by every session, so the threshold stays on this session's processor
+            st.session_state.llm_processor.semantic_cache = get_semantic_cache()
+            st.session_state.llm_processor.semantic_threshold = similarity_threshold
+        else:
+            st.session_state.llm_processor.semantic_cache = None
+        
+        llm = st.session_state.llm_processor
+        if llm.response_cache is not None:
+            if st.button("🗑️ Clear cache"):
+                llm.response_cache.clear()
+                llm.cache_hits = 0
+                llm.semantic_hits = 0
+                llm.cache_misses = 0
+                st.success("Response cache cleared")
+        
+        st.divider()
+        
+        batch_mode = False
         if provider == "ollama":
             # Ollama settings
             st.subheader("🖥️ Ollama Settings")
             
+            if st.button("🔄 Refresh", help="Re-check Ollama status and installed models"):
+                fetch_ollama_status.clear()
+                fetch_ollama_models.clear()
+            
             # Check Ollama status
             ollama_status = st.session_state.llm_processor.is_ollama_running()
             status_color = "🟢" if ollama_status else "🔴"
@@ -439,7 +1520,7 @@ def main():
             if not ollama_status:
                 st.warning("Ollama is not running. Please start Ollama to use LLM processing.")
                 st.markdown("**To start Ollama:**")
-                st.code("ollama serve", language="bash")
+                st.code(f"OLLAMA_NUM_PARALLEL={max_concurrency} ollama serve", language="bash")
             
             # Model selection
             if ollama_status:
@@ -451,6 +1532,9 @@ def main():
                         index=0 if available_models else None
                     )
                     st.session_state.llm_processor.model_name = selected_model
+                    st.session_state.llm_processor.warm_up()
+                    st.caption(f"Ollama only works on OLLAMA_NUM_PARALLEL requests at once and queues the rest. "
+                               f"Start it with `OLLAMA_NUM_PARALLEL={max_concurrency} ollama serve` to match the concurrency setting.")
                 else:
                     st.warning("No models found. Please pull a model first:")
                     st.code("ollama pull llama2", language="bash")
@@ -476,7 +1560,9 @@ def main():
                 if api_key:
                     st.session_state.llm_processor.openai_api_key = api_key
                     try:
-                        st.session_state.llm_processor.openai_client = OpenAI(api_key=api_key)
+                        st.session_state.llm_processor.openai_client = get_openai_client(
+                            hashlib.sha256(api_key.encode()).hexdigest(), api_key
+                        )
                         st.success("✅ API Key configured")
                     except Exception as e:
                         st.error(f"❌ Invalid API Key: {str(e)}")
@@ -494,6 +1580,32 @@ def main():
                         )
                         st.session_state.llm_processor.model_name = selected_model
                         
+                        processing_mode = st.radio(
+                            "Processing mode:",
+                            ["Interactive", "Batch (50% cheaper)"],
+                            index=0,
+                            help=f"Batch mode submits jobs of more than {OPENAI_BATCH_THRESHOLD} rows to the OpenAI Batch API. It costs half as much but can take up to 24 hours; keep the page open until it finishes."
+                        )
+                        batch_mode = processing_mode != "Interactive"
+                        
+                        with st.expander("Rate limits"):
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                st.session_state.llm_processor.rate_limiter.requests_per_minute = st.number_input(
+                                    "Requests/min",
+                                    min_value=1,
+                                    value=st.session_state.llm_processor.rate_limiter.requests_per_minute,
+                                    step=50
+                                )
+                            with col2:
+                                st.session_state.llm_processor.rate_limiter.tokens_per_minute = st.number_input(
+                                    "Tokens/min",
+                                    min_value=1_000,
+                                    value=st.session_state.llm_processor.rate_limiter.tokens_per_minute,
+                                    step=10_000
+                                )
+                            st.caption("Match these to your OpenAI account tier; interactive requests are held back to stay under them.")
+                        
                         # Show estimated costs
                         st.info("💡 **Cost Estimates (per 1K tokens):**\n"
                                "- GPT-4o: ~$0.015\n"
@@ -542,11 +1654,7 @@ def main():
                         st.write(f"{i+1}. `{col}` (type: {df[col].dtype})")
                 
                 # Try to auto-detect agent_notes column
-                agent_notes_col = None
-                for col in columns:
-                    if 'agent' in col.lower() and 'note' in col.lower():
-                        agent_notes_col = col
-                        break
+                agent_notes_col = detect_notes_column(tuple(columns))
                 
                 selected_column = st.selectbox(
                     "Select the column containing agent notes:",
@@ -573,140 +1681,7 @@ def main():
                     with st.expander("View sample text", expanded=True):
                         st.text_area("Original text", sample_text, height=150, disabled=True, key="file_sample")
                 
-                # Custom prompt input
-                st.subheader("🎯 Custom Prompt (Optional)")
-                custom_prompt = st.text_area(
-                    "Enter a custom prompt for the LLM to follow (e.g., 'Summarize this call in 50 words or less. Only include key points.'). Leave empty for default prompt.",
-                    height=100,
-                    help="Customize how the AI processes your data. The original text will be automatically appended to your prompt.",
-                    key="file_custom_prompt"
-                )
-                
-                # Processing options
-                st.subheader("🔧 Processing Options")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    process_all = st.checkbox("Process all rows", value=False, key="file_process_all")
-                    if not process_all:
-                        max_rows = st.number_input("Number of rows to process:", min_value=1, max_value=len(df), value=min(10, len(df)), key="file_max_rows")
-                    else:
-                        max_rows = len(df)
-                
-                with col2:
-                    create_new_column = st.checkbox("Create new column for processed text", value=True, key="file_new_column")
-                    if create_new_column:
-                        new_column_name = st.text_input("New column name:", value="agent_notes_processed", key="file_column_name")
-                
-                # Process button
-                if st.button("🚀 Start Processing", type="primary", disabled=not provider_ready, key="file_process_button"):
-                    if not provider_ready:
-                        if provider == "ollama":
-                            st.error("Please start Ollama first!")
-                        else:
-                            st.error("Please configure OpenAI API key first!")
-                        return
-                    
-                    # Create progress tracking
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Create containers for real-time display
-                    st.subheader("🔄 Live Processing Results")
-                    results_container = st.container()
-                    
-                    # Process data
-                    processed_df = df.copy()
-                    processed_texts = []
-                    
-                    rows_to_process = min(max_rows, len(df))
-                    
-                    with results_container:
-                        for i in range(rows_to_process):
-                            status_text.text(f"Processing row {i+1} of {rows_to_process}...")
-                            progress_bar.progress((i) / rows_to_process)
-                            
-                            original_text = str(df.iloc[i][selected_column])
-                            
-                            # Create expandable section for each row
-                            with st.expander(f"Row {i+1} - {'Processing...' if pd.notna(original_text) and original_text.strip() != '' and original_text != 'nan' else 'Skipped (empty)'}", expanded=i < 3):
-                                col1, col2 = st.columns([1, 1])
-                                
-                                with col1:
-                                    st.markdown("**📝 Original Text:**")
-                                    if pd.isna(original_text) or original_text.strip() == '' or original_text == 'nan':
-                                        st.info("No content to process")
-                                        processed_text = "No content to process"
-                                    else:
-                                        st.text_area("Original", original_text, height=200, disabled=True, key=f"orig_{i}")
-                                
-                                with col2:
-                                    st.markdown("**🤖 LLM Output:**")
-                                    if pd.isna(original_text) or original_text.strip() == '' or original_text == 'nan':
-                                        st.info("Skipped - No content")
-                                        processed_text = "No content to process"
-                                    else:
-                                        # Show processing indicator
-                                        processing_placeholder = st.empty()
-                                        processing_placeholder.info("🔄 Processing with LLM...")
-                                        
-                                        # Process the text with anonymization if enabled
-                                        enable_anon = st.session_state.get('enable_anonymization', False)
-                                        processed_text = st.session_state.llm_processor.process_text(original_text, custom_prompt, enable_anon)
-                                        
-                                        # Replace processing indicator with result
-                                        processing_placeholder.empty()
-                                        st.text_area("Processed", processed_text, height=200, disabled=True, key=f"proc_{i}")
-                                
-                                processed_texts.append(processed_text)
-                            
-                            # Update progress
-                            progress_bar.progress((i + 1) / rows_to_process)
-                    
-                    # Add processed text to dataframe
-                    if create_new_column:
-                        processed_df[new_column_name] = processed_texts + [''] * (len(df) - len(processed_texts))
-                    else:
-                        processed_df.loc[:len(processed_texts)-1, selected_column] = processed_texts
-                    
-                    status_text.text("✅ Processing complete!")
-                    st.success(f"Successfully processed {rows_to_process} rows!")
-                    
-                    # Show final results summary
-                    st.subheader("📊 Final Results Summary")
-                    st.dataframe(processed_df, use_container_width=True, height=300)
-                    
-                    # Download options
-                    st.subheader("💾 Download Results")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        # CSV download
-                        csv_buffer = io.StringIO()
-                        processed_df.to_csv(csv_buffer, index=False)
-                        csv_data = csv_buffer.getvalue()
-                        
-                        st.download_button(
-                            label="📥 Download as CSV",
-                            data=csv_data,
-                            file_name=generate_filename("processed_data", "csv"),
-                            mime="text/csv"
-                        )
-                    
-                    with col2:
-                        # Excel download
-                        excel_buffer = io.BytesIO()
-                        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                            processed_df.to_excel(writer, index=False, sheet_name='Processed Data')
-                        excel_data = excel_buffer.getvalue()
-                        
-                        st.download_button(
-                            label="📥 Download as Excel",
-                            data=excel_data,
-                            file_name=generate_filename("processed_data", "xlsx"),
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                processing_panel(df, selected_column, provider, provider_ready, max_concurrency, batch_mode, live_preview_rows, key="file")
 
             else:
                 # File failed to load - provide detailed error information
@@ -778,14 +1753,13 @@ def main():
                     # Show both raw bytes and attempt to decode
                     st.write(f"**First 100 bytes (raw):** `{first_bytes}`")
                     
-                    # Try to show what characters these bytes represent
-                    for encoding in ['gb2312', 'gbk', 'big5', 'shift_jis']:
-                        try:
-                            decoded = first_bytes.decode(encoding)
-                            st.write(f"**As {encoding}:** `{decoded[:50]}...`")
-                            break
-                        except:
-                            continue
+                    # Show what characters these bytes represent in the most probable encoding
+                    # (scored by charset_normalizer, so GBK, Big5 and Shift-JIS are covered too)
+                    best = from_bytes(first_bytes).best() if CHARSET_NORMALIZER_AVAILABLE else None
+                    if best is not None:
+                        st.write(f"**Detected {best.encoding}:** `{str(best)[:50]}...`")
+                    else:
+                        st.write("**Encoding:** could not be detected from the first bytes")
                             
                 except Exception as e:
                     st.write(f"**Cannot read file bytes:** {str(e)}")
@@ -853,11 +1827,7 @@ def main():
             columns = df.columns.tolist()
             
             # Try to auto-detect agent_notes column
-            agent_notes_col = None
-            for col in columns:
-                if 'agent' in col.lower() and 'note' in col.lower():
-                    agent_notes_col = col
-                    break
+            agent_notes_col = detect_notes_column(tuple(columns))
             
             selected_column = st.selectbox(
                 "Select the column containing agent notes:",
@@ -878,140 +1848,7 @@ def main():
                 with st.expander("View sample text", expanded=True):
                     st.text_area("Original text", sample_text, height=150, disabled=True, key="paste_sample")
             
-            # Custom prompt input
-            st.subheader("🎯 Custom Prompt (Optional)")
-            custom_prompt = st.text_area(
-                "Enter a custom prompt for the LLM to follow (e.g., 'Summarize this call in 50 words or less. Only include key points.'). Leave empty for default prompt.",
-                height=100,
-                help="Customize how the AI processes your data. The original text will be automatically appended to your prompt.",
-                key="paste_custom_prompt"
-            )
-            
-            # Processing options
-            st.subheader("🔧 Processing Options")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                process_all = st.checkbox("Process all rows", value=False, key="paste_process_all")
-                if not process_all:
-                    max_rows = st.number_input("Number of rows to process:", min_value=1, max_value=len(df), value=min(10, len(df)), key="paste_max_rows")
-                else:
-                    max_rows = len(df)
-            
-            with col2:
-                create_new_column = st.checkbox("Create new column for processed text", value=True, key="paste_new_column")
-                if create_new_column:
-                    new_column_name = st.text_input("New column name:", value="agent_notes_processed", key="paste_column_name")
-            
-            # Process button
-            if st.button("🚀 Start Processing", type="primary", disabled=not provider_ready, key="paste_process_button"):
-                if not provider_ready:
-                    if provider == "ollama":
-                        st.error("Please start Ollama first!")
-                    else:
-                        st.error("Please configure OpenAI API key first!")
-                    return
-                
-                # Create progress tracking
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                # Create containers for real-time display
-                st.subheader("🔄 Live Processing Results")
-                results_container = st.container()
-                
-                # Process data
-                processed_df = df.copy()
-                processed_texts = []
-                
-                rows_to_process = min(max_rows, len(df))
-                
-                with results_container:
-                    for i in range(rows_to_process):
-                        status_text.text(f"Processing row {i+1} of {rows_to_process}...")
-                        progress_bar.progress((i) / rows_to_process)
-                        
-                        original_text = str(df.iloc[i][selected_column])
-                        
-                        # Create expandable section for each row
-                        with st.expander(f"Row {i+1} - {'Processing...' if pd.notna(original_text) and original_text.strip() != '' and original_text != 'nan' else 'Skipped (empty)'}", expanded=i < 3):
-                            col1, col2 = st.columns([1, 1])
-                            
-                            with col1:
-                                st.markdown("**📝 Original Text:**")
-                                if pd.isna(original_text) or original_text.strip() == '' or original_text == 'nan':
-                                    st.info("No content to process")
-                                    processed_text = "No content to process"
-                                else:
-                                    st.text_area("Original", original_text, height=200, disabled=True, key=f"orig_paste_{i}")
-                            
-                            with col2:
-                                st.markdown("**🤖 LLM Output:**")
-                                if pd.isna(original_text) or original_text.strip() == '' or original_text == 'nan':
-                                    st.info("Skipped - No content")
-                                    processed_text = "No content to process"
-                                else:
-                                    # Show processing indicator
-                                    processing_placeholder = st.empty()
-                                    processing_placeholder.info("🔄 Processing with LLM...")
-                                    
-                                    # Process the text with anonymization if enabled
-                                    enable_anon = st.session_state.get('enable_anonymization', False)
-                                    processed_text = st.session_state.llm_processor.process_text(original_text, custom_prompt, enable_anon)
-                                    
-                                    # Replace processing indicator with result
-                                    processing_placeholder.empty()
-                                    st.text_area("Processed", processed_text, height=200, disabled=True, key=f"proc_paste_{i}")
-                            
-                            processed_texts.append(processed_text)
-                        
-                        # Update progress
-                        progress_bar.progress((i + 1) / rows_to_process)
-                
-                # Add processed text to dataframe
-                if create_new_column:
-                    processed_df[new_column_name] = processed_texts + [''] * (len(df) - len(processed_texts))
-                else:
-                    processed_df.loc[:len(processed_texts)-1, selected_column] = processed_texts
-                
-                status_text.text("✅ Processing complete!")
-                st.success(f"Successfully processed {rows_to_process} rows!")
-                
-                # Show final results summary
-                st.subheader("📊 Final Results Summary")
-                st.dataframe(processed_df, use_container_width=True, height=300)
-                
-                # Download options
-                st.subheader("💾 Download Results")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    # CSV download
-                    csv_buffer = io.StringIO()
-                    processed_df.to_csv(csv_buffer, index=False)
-                    csv_data = csv_buffer.getvalue()
-                    
-                    st.download_button(
-                        label="📥 Download as CSV",
-                        data=csv_data,
-                        file_name=generate_filename("processed_data", "csv"),
-                        mime="text/csv"
-                    )
-                
-                with col2:
-                    # Excel download
-                    excel_buffer = io.BytesIO()
-                    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                        processed_df.to_excel(writer, index=False, sheet_name='Processed Data')
-                    excel_data = excel_buffer.getvalue()
-                    
-                    st.download_button(
-                        label="📥 Download as Excel",
-                        data=excel_data,
-                        file_name=generate_filename("processed_data", "xlsx"),
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+            processing_panel(df, selected_column, provider, provider_ready, max_concurrency, batch_mode, live_preview_rows, key="paste")
 
 if __name__ == "__main__":
     main()
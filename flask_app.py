@@ -1,9 +1,14 @@
 from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import importlib.util
 import io
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import re
 import os
@@ -14,14 +19,40 @@ try:
 except ImportError:
     OPENAI_AVAILABLE = False
 
+# pandas imports the calamine reader itself, so only its presence is checked here
+CALAMINE_AVAILABLE = importlib.util.find_spec("python_calamine") is not None
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 UPLOAD_FOLDER = 'uploads'
+EXPORT_CHUNK_SIZE = 10_000  # rows serialized per chunk when writing the processed file
+MAX_WORKERS = 8  # LLM requests in flight at once
+# Copy-on-Write is the default from pandas 3; turn it on for 2.x as well
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+def build_http_session() -> requests.Session:
+    """Pooled keep-alive session so Ollama calls reuse connections instead of reconnecting per row"""
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,  # Ollama generate calls are safe to retry
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retries)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Shared by every request handler and worker thread
+http_session = build_http_session()
+
 class LLMProcessor:
     """Handles communication with LLMs via Ollama or OpenAI"""
     
@@ -38,7 +69,7 @@ class LLMProcessor:
     def is_ollama_running(self) -> bool:
         """Check if Ollama is running and accessible"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = http_session.get(f"{self.base_url}/api/tags", timeout=5)
             return response.status_code == 200
         except:
             return False
@@ -99,7 +130,7 @@ Clean summary:"""
     def _process_with_ollama(self, prompt: str) -> str:
         """Process text using Ollama"""
         try:
-            response = requests.post(
+            response = http_session.post(
                 f"{self.base_url}/api/generate",
                 json={
                     "model": self.model_name,
@@ -177,6 +208,12 @@ def load_file(file_path):
         if file_path.endswith('.csv'):
             return pd.read_csv(file_path)
         elif file_path.endswith(('.xlsx', '.xls')):
+            # The Rust calamine reader is several times faster than openpyxl/xlrd
+            if CALAMINE_AVAILABLE:
+                try:
+                    return pd.read_excel(file_path, engine="calamine")
+                except Exception as e:
+                    print(f"calamine engine failed, using default reader: {e}")
             return pd.read_excel(file_path)
         else:
             return None
@@ -243,36 +280,45 @@ def process_data():
         openai_api_key=api_key if provider == 'openai' else None
     )
     
-    results = []
-    processed_df = df.copy()
+    def process_one(original_text):
+        return processor.process_text(
+            original_text, 
+            custom_prompt if custom_prompt.strip() else None,
+            enable_anonymization
+        )
     
-    # Process rows
+    # Process rows; the column is converted to strings and checked for empty cells once
+    # instead of row by row
     rows_to_process = min(max_rows, len(df))
-    for i in range(rows_to_process):
-        original_text = str(df.iloc[i][selected_column])
-        
-        if pd.isna(original_text) or original_text.strip() == '' or original_text == 'nan':
-            processed_text = "No content to process"
-        else:
-            processed_text = processor.process_text(
-                original_text, 
-                custom_prompt if custom_prompt.strip() else None,
-                enable_anonymization
-            )
-        
-        results.append({
+    column = df[selected_column].iloc[:rows_to_process]
+    column_text = column.astype(str).str.strip()
+    col_values = column_text.to_numpy()
+    empty_mask = (column.isna() | column_text.isin(['', 'nan'])).to_numpy()
+    work_idx = np.flatnonzero(~empty_mask)
+    
+    # Each row is a network-bound LLM call, so several run in threads at once; map() keeps row order
+    processed_texts = np.full(rows_to_process, "No content to process", dtype=object)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        processed_texts[work_idx] = list(executor.map(process_one, col_values[work_idx]))
+    
+    results = [
+        {
             'row': i + 1,
             'original': original_text,
             'processed': processed_text
-        })
-        
-        # Add to dataframe
-        processed_df.loc[i, f"{selected_column}_processed"] = processed_text
+        }
+        for i, (original_text, processed_text) in enumerate(zip(col_values, processed_texts))
+    ]
+    
+    # Add the column to a shallow copy, which shares the untouched columns with df instead of
+    # duplicating the frame; rows past rows_to_process stay empty
+    processed_df = df.copy(deep=False)
+    processed_df[f"{selected_column}_processed"] = pd.Series(processed_texts, index=df.index[:rows_to_process], dtype=object)
     
     # Save processed file
     output_filename = generate_filename("processed_data", "csv")
     output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-    processed_df.to_csv(output_path, index=False)
+    processed_df.to_csv(output_path, index=False, encoding='utf-8', lineterminator='\n', chunksize=EXPORT_CHUNK_SIZE)
     
     return render_template('results.html', 
                          results=results, 